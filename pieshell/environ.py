@@ -7,6 +7,7 @@ import contextlib
 import pkg_resources
 import types
 import builtins
+import concurrent.futures
 
 from . import pipeline
 from . import redir
@@ -58,6 +59,7 @@ class Environment(object):
             redirects.redirect(2, redir.STRING)
         self._redirects = redirects
         self._clear_dir_cache()
+        self._process_pools = {}
         self.running_pipelines = utils.LineList()
     @property
     def _exports(self):
@@ -162,6 +164,13 @@ class Environment(object):
             return "[%s:%s]" % (str(id(self))[:3], self._cwd)
     def _clear_dir_cache(self):
         self._dir_cache = None
+    def _process_pool(self, workers = None):
+        """Returns a pool of worker processes, that is started the
+        first time it is asked for and then reused for the lifetime of
+        this environment."""
+        if workers not in self._process_pools:
+            self._process_pools[workers] = concurrent.futures.ProcessPoolExecutor(workers)
+        return self._process_pools[workers]
     def __dir__(self):
         if self._dir_cache is None:
             e = self._exports
@@ -192,6 +201,7 @@ class Environment(object):
         def mangle(k, v):
             if k == "_scope": return None
             if k == "last_pipeline": return v.pipeline
+            if k == "_process_pools": return {}
             return v
         return {k: mangle(k, v) for k, v in self.__dict__.items()}
 
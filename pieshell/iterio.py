@@ -2,12 +2,19 @@ import os
 import select
 import signal
 import errno
+import collections
 from . import log
 import asyncio
 from .utils.asyncutils import asyncmap, itertoasync
+from .utils import pipe
 
 class RecursiveEvent(Exception): pass
 
+try:
+    IOV_MAX = os.sysconf("SC_IOV_MAX")
+except:
+    IOV_MAX = 1024
+
 def events_to_str(events):
     return ",".join([name for name in dir(select)
                      if (    name.startswith("POLL")
@@ -17,13 +24,14 @@ def events_to_str(events):
 
 class IOHandler(object):
     events = 0
-    def __init__(self, fd, borrowed = False, usage = None):
+    def __init__(self, fd, borrowed = False, usage = None, enabled = True):
         self.fd = fd
         self.borrowed = borrowed
-        self.enabled = True
+        self.enabled = False
         self.usage = usage
         self.destroyed = False
-        self.enable()
+        if enabled:
+            self.enable()
     def handle_event(self, event):
         pass
     def destroy(self):
@@ -64,14 +72,12 @@ class IOHandler(object):
         t = type(self)
         return "%s.%s(%s)" % (t.__module__, t.__name__, ",".join(self._repr_args()))
 
-class OutputHandler(IOHandler):
-    events = select.POLLOUT
-
-    def __init__(self, fd, iter, borrowed = False, usage = None):
-        self.iter = iter
-        self.recursion_lock = False
+class WaitableHandler(IOHandler):
+    """An IOHandler that does some work and then finishes, and that
+    can be waited for."""
+    def __init__(self, fd, borrowed = False, usage = None, enabled = True):
         self.done_future = asyncio.get_event_loop().create_future()
-        IOHandler.__init__(self, fd, borrowed, usage)
+        IOHandler.__init__(self, fd, borrowed, usage, enabled)
 
     @property
     def is_running(self):
@@ -93,8 +99,60 @@ class OutputHandler(IOHandler):
                 self.done_future.set_result(value)
         IOHandler.destroy(self)
 
-    def handle_event(self, event):
-        asyncio.get_event_loop().create_task(self.send_output())
+    def _repr_args(self):
+        args = IOHandler._repr_args(self)
+        if not self.is_running:
+            args.append("stopped")
+        return args
+
+class OutputHandler(WaitableHandler):
+    """Writes the items (bytes) of an iterator or async iterator to
+    fd.
+
+    A single pump task pulls items from the iterator and queues them.
+    Queued items are written together using os.writev, and partial
+    writes are resumed when the fd becomes writable again. In
+    "latency" mode, queued data is flushed as soon as the event loop
+    gets control, so items produced in a burst are still written
+    together. In "throughput" mode, data is flushed when flush_bytes
+    have been queued, or flush_interval seconds after the first
+    unflushed item was queued. The pump waits for the queue to drain
+    whenever more than max_pending_bytes are queued.
+    """
+    events = select.POLLOUT
+    mode = "latency"
+    flush_bytes = 64 * 1024
+    flush_interval = 0.01
+    max_pending_bytes = 1024 * 1024
+
+    def __init__(self, fd, iter, borrowed = False, usage = None, mode = None, nonblocking = None):
+        self.iter = iter
+        if mode is not None:
+            self.mode = mode
+        self.pending = []
+        self.pending_bytes = 0
+        self.flush_handle = None
+        self.flush_immediate = False
+        self.drained_future = None
+        if nonblocking is None:
+            nonblocking = not borrowed and pipe.is_fifo(fd)
+        if nonblocking:
+            pipe.set_nonblocking(fd)
+        self.nonblocking = nonblocking
+        self.pollable = pipe.is_pollable(fd)
+        # A blocking write to a pipe only succeeds without blocking
+        # if it is no larger than PIPE_BUF
+        self.limit_writes = not nonblocking and pipe.is_fifo(fd)
+        WaitableHandler.__init__(self, fd, borrowed, usage, enabled=False)
+        self.pump_task = asyncio.get_event_loop().create_task(self.pump())
+
+    def destroy(self, exception = None, value = None):
+        if self.flush_handle is not None:
+            self.flush_handle.cancel()
+            self.flush_handle = None
+        if self.drained_future is not None and not self.drained_future.done():
+            self.drained_future.set_result(None)
+        WaitableHandler.destroy(self, exception, value)
 
     def get_iter(self):
         if not hasattr(self.iter, "__anext__"):
@@ -102,73 +160,388 @@ class OutputHandler(IOHandler):
                 self.iter = itertoasync(self.iter)
             self.iter = self.iter.__aiter__()
         return self.iter
-            
-    async def send_output(self):
-        if self.recursion_lock: return
+
+    def queue(self, val):
+        self.pending.append(val)
+        self.pending_bytes += len(val)
+
+    def schedule_flush(self, immediate = False):
+        if self.enabled or self.destroyed:
+            # Already waiting for the fd to become writable
+            return
+        immediate = immediate or self.mode == "latency" or self.pending_bytes >= self.flush_bytes
+        if self.flush_handle is not None:
+            if self.flush_immediate or not immediate:
+                return
+            self.flush_handle.cancel()
+        loop = asyncio.get_event_loop()
+        self.flush_immediate = immediate
+        if immediate:
+            self.flush_handle = loop.call_soon(self.flush)
+        else:
+            self.flush_handle = loop.call_later(self.flush_interval, self.flush)
+
+    def flush(self):
+        self.flush_handle = None
+        if self.destroyed:
+            return
+        if not self.pollable:
+            # Regular files are always writable, and can not be polled
+            while self.pending and not self.destroyed:
+                self.write_pending()
+            return
+        if self.nonblocking:
+            self.write_pending()
+        if self.pending and not self.destroyed:
+            self.enable()
+
+    def handle_event(self, event):
+        self.write_pending()
+        if not self.pending and self.enabled:
+            self.disable()
+
+    def write_pending(self):
+        pending = self.pending
+        if not pending:
+            return
+        if self.limit_writes:
+            iov = []
+            size = 0
+            for item in pending:
+                if size + len(item) > select.PIPE_BUF:
+                    if not iov:
+                        iov.append(memoryview(item)[:select.PIPE_BUF])
+                    break
+                iov.append(item)
+                size += len(item)
+        else:
+            iov = pending[:IOV_MAX]
+        try:
+            written = os.writev(self.fd, iov)
+        except BlockingIOError:
+            return
+        except Exception as e:
+            self.pump_task.cancel()
+            self.destroy(e)
+            return
+        log.log("WRITE %s, %s bytes" % (self.fd, written), "io")
+        self.pending_bytes -= written
+        idx = 0
+        while idx < len(pending) and len(pending[idx]) <= written:
+            written -= len(pending[idx])
+            idx += 1
+        del pending[:idx]
+        if written:
+            pending[0] = memoryview(pending[0])[written:]
+        if not pending and self.drained_future is not None:
+            if not self.drained_future.done():
+                self.drained_future.set_result(None)
+            self.drained_future = None
+
+    async def drained(self):
+        """Flushes all queued data and waits until it has been
+        written."""
+        if not self.pending:
+            return
+        self.schedule_flush(True)
+        self.drained_future = asyncio.get_event_loop().create_future()
+        await self.drained_future
+
+    async def pump(self):
         iter = self.get_iter()
         try:
-            self.recursion_lock = True
-            val = await iter.__anext__()
-            self.recursion_lock = False
-            if val is not None:
-                os.write(self.fd, val)                
-        except StopAsyncIteration:
-            self.destroy()
+            while True:
+                try:
+                    val = await iter.__anext__()
+                except StopAsyncIteration:
+                    break
+                if val is not None:
+                    self.queue(val)
+                    self.schedule_flush()
+                    if self.pending_bytes > self.max_pending_bytes:
+                        await self.drained()
+            log.log("STOP ITERATION %s" % self.fd, "ioevent")
+            await self.drained()
         except Exception as e:
             self.destroy(e)
+        else:
+            self.destroy()
 
     def _repr_args(self):
-        args = IOHandler._repr_args(self)
-        if not self.is_running:
-            args.append("stopped")
+        args = WaitableHandler._repr_args(self)
+        if self.pending_bytes:
+            args.append("%s bytes pending" % self.pending_bytes)
         return args
 
 
 class LineOutputHandler(OutputHandler):
-    async def send_output(self):
-        if self.recursion_lock: return
-        iter = self.get_iter()
+    def queue(self, val):
+        self.pending.append(val)
+        self.pending.append(b"\n")
+        self.pending_bytes += len(val) + 1
+
+class CopyHandler(WaitableHandler):
+    """Copies everything from source to fd, inside the kernel where
+    possible.
+
+    source is an fd or a binary file object. splice(2) is used if
+    either end is a pipe, sendfile(2) if source is a regular file and
+    copy_file_range(2) if both ends are regular files. Anything else
+    (or a kernel that refuses the call) falls back to read/write.
+    """
+    chunk_size = 1024 * 1024
+    max_per_event = 16 * 1024 * 1024
+
+    def __init__(self, fd, source, borrowed = False, usage = None, source_borrowed = False, nonblocking = None, source_nonblocking = None):
+        self.source = source
+        self.source_borrowed = source_borrowed
+        if hasattr(source, "fileno"):
+            self.source_fd = source.fileno()
+            if source.seekable() and hasattr(source, "peek"):
+                # Data already read into the file object buffer
+                # must not be skipped
+                os.lseek(self.source_fd, source.tell(), os.SEEK_SET)
+        else:
+            self.source_fd = source
+        if nonblocking is None:
+            nonblocking = not borrowed and pipe.is_fifo(fd)
+        if nonblocking:
+            pipe.set_nonblocking(fd)
+        if source_nonblocking is None:
+            source_nonblocking = not source_borrowed and pipe.is_fifo(self.source_fd)
+        if source_nonblocking:
+            pipe.set_nonblocking(self.source_fd)
+        self.source_nonblocking = source_nonblocking
+        # See OutputHandler
+        self.limit_writes = not nonblocking and pipe.is_fifo(fd)
+        self.source_pollable = pipe.is_pollable(self.source_fd)
+        self.pollable = pipe.is_pollable(fd)
+        self.method = self.select_method(self.source_fd, fd)
+        self.leftover = None
+        self.idle_handle = None
+        self.copied = 0
+        WaitableHandler.__init__(self, fd, borrowed, usage)
+
+    def select_method(self, source_fd, fd):
+        source_fifo = pipe.is_fifo(source_fd)
+        source_regular = pipe.is_regular(source_fd)
+        if hasattr(os, "splice") and (source_fifo or pipe.is_fifo(fd)):
+            return "splice"
+        elif hasattr(os, "copy_file_range") and source_regular and pipe.is_regular(fd):
+            return "copy_file_range"
+        elif hasattr(os, "sendfile") and source_regular:
+            return "sendfile"
+        return "readwrite"
+
+    def enable(self):
+        self.enabled = True
+        loop = asyncio.get_event_loop()
+        if self.source_pollable:
+            loop.add_reader(self.source_fd, self.handle_event, select.POLLIN)
+        elif self.pollable:
+            loop.add_writer(self.fd, self.handle_event, select.POLLOUT)
+        else:
+            # Regular files can not be polled, copy a bit at a time
+            # so as not to starve other handlers
+            self.idle_handle = loop.call_soon(self.handle_event, None)
+        log.log("REGISTER %s, COPY FROM %s, %s" % (self.fd, self.source_fd, self), "ioreg")
+
+    def disable(self):
+        self.enabled = False
+        loop = asyncio.get_event_loop()
+        if self.source_pollable:
+            loop.remove_reader(self.source_fd)
+        elif self.pollable:
+            loop.remove_writer(self.fd)
+        elif self.idle_handle is not None:
+            self.idle_handle.cancel()
+            self.idle_handle = None
+
+    def wait_writable(self):
+        self.disable()
+        def writable():
+            asyncio.get_event_loop().remove_writer(self.fd)
+            if not self.destroyed:
+                self.enable()
+        asyncio.get_event_loop().add_writer(self.fd, writable)
+
+    def copy_chunk(self):
+        if self.leftover is not None:
+            data = self.leftover
+            if self.limit_writes:
+                data = data[:select.PIPE_BUF]
+            written = os.write(self.fd, data)
+            self.leftover = self.leftover[written:] if written < len(self.leftover) else None
+            return written
+        if self.method == "splice":
+            return os.splice(self.source_fd, self.fd, self.chunk_size,
+                             flags=os.SPLICE_F_MOVE | os.SPLICE_F_NONBLOCK)
+        elif self.method == "copy_file_range":
+            return os.copy_file_range(self.source_fd, self.fd, self.chunk_size)
+        elif self.method == "sendfile":
+            return os.sendfile(self.fd, self.source_fd, None, self.chunk_size)
+        data = os.read(self.source_fd, self.chunk_size)
+        if not data:
+            return 0
+        self.leftover = memoryview(data)
+        self.copy_chunk()
+        return len(data)
+
+    def handle_event(self, event):
+        self.idle_handle = None
+        copied = 0
         try:
-            self.recursion_lock = True
-            val = await iter.__anext__()
-            self.recursion_lock = False
-            if val is not None:
-                os.write(self.fd, val + b"\n")
-            log.log("WRITE %s, %s" % (self.fd, repr(val)), "io")
-        except StopAsyncIteration:
-            log.log("STOP ITERATION %s" % self.fd, "ioevent")
-            self.destroy()
+            while copied < self.max_per_event:
+                try:
+                    n = self.copy_chunk()
+                except BlockingIOError:
+                    if self.source_pollable and self.pollable and self.leftover is None:
+                        # Either source is empty or fd is full; wait
+                        # for fd first, then for source
+                        self.wait_writable()
+                    elif self.leftover is not None and self.source_pollable:
+                        self.wait_writable()
+                    return
+                except OSError as e:
+                    if self.method != "readwrite" and e.errno in (
+                            errno.EINVAL, errno.ENOSYS, errno.EXDEV,
+                            errno.EOPNOTSUPP, errno.EBADF):
+                        log.log("COPY FALLBACK %s, %s: %s" % (self.fd, self.method, e), "io")
+                        self.method = "readwrite"
+                        continue
+                    raise
+                if n == 0 and self.leftover is None:
+                    log.log("COPY DONE %s, %s bytes" % (self.fd, self.copied + copied), "ioevent")
+                    self.copied += copied
+                    self.destroy()
+                    return
+                copied += n
+                if (self.method == "readwrite" and self.source_pollable
+                    and not self.source_nonblocking):
+                    # Another read could block
+                    break
         except Exception as e:
             self.destroy(e)
+            return
+        finally:
+            if not self.destroyed:
+                self.copied += copied
+        if self.enabled and not self.pollable and not self.source_pollable:
+            self.idle_handle = asyncio.get_event_loop().call_soon(self.handle_event, None)
+
+    def destroy(self, exception = None, value = None):
+        if self.destroyed: return
+        if self.enabled:
+            self.disable()
+        if hasattr(self.source, "close"):
+            if not self.source_borrowed:
+                self.source.close()
+        elif not self.source_borrowed:
+            os.close(self.source_fd)
+        WaitableHandler.destroy(self, exception, value)
+
+    def _repr_args(self):
+        args = WaitableHandler._repr_args(self)
+        args.append("from %s" % self.source_fd)
+        args.append(self.method)
+        return args
 
 class InputHandler(IOHandler):
+    """Reads data from fd and makes it available as an async
+    iterator of chunks.
+
+    Every readiness event drains the fd (until EAGAIN, for pipes that
+    can be made non-blocking) into a reusable buffer, whose size adapts
+    to the amount of data available, between min_read_size and
+    max_read_size.
+
+    If zerocopy is True, chunks are memoryview slices of the internal
+    buffer, and are only valid until the next call to __anext__().
+    Otherwise they are bytes objects.
+    """
     events = select.POLLIN | select.POLLHUP | select.POLLERR
-    
-    def __init__(self, fd, borrowed = False, usage = None, at_eof = None):
+    min_read_size = 64 * 1024
+    max_read_size = 4 * 1024 * 1024
+
+    def __init__(self, fd, borrowed = False, usage = None, at_eof = None, zerocopy = False, nonblocking = None):
         self.buffer = None
         self.eof = False
         self.future = None
         self.at_eof = at_eof
+        self.zerocopy = zerocopy
+        self.read_size = self.min_read_size
+        self.read_buffers = [None, None]
+        # Only make pipes we own non-blocking, as the flag is shared
+        # with anyone else holding the same pipe end.
+        if nonblocking is None:
+            nonblocking = not borrowed and pipe.is_fifo(fd)
+        if nonblocking:
+            pipe.set_nonblocking(fd)
+        self.nonblocking = nonblocking
         IOHandler.__init__(self, fd, borrowed, usage)
 
+    def read_chunk(self):
+        """Reads what is currently available on the fd into the read
+        buffer. Returns a memoryview of the data read, an empty
+        memoryview at EOF, or None if there was nothing to read."""
+        size = self.read_size
+        if self.zerocopy:
+            # The last chunk handed out stays in use until the next
+            # call to __anext__, but the fd can be read before that.
+            self.read_buffers.reverse()
+        if self.read_buffers[0] is None or len(self.read_buffers[0]) != size:
+            self.read_buffers[0] = bytearray(size)
+        view = memoryview(self.read_buffers[0])
+        pos = 0
+        while pos < size:
+            try:
+                length = os.readv(self.fd, [view[pos:]])
+            except BlockingIOError:
+                if not pos:
+                    return None
+                break
+            if not length:
+                break
+            pos += length
+            if not self.nonblocking:
+                break
+        if pos == size:
+            self.read_size = min(size * 2, self.max_read_size)
+        elif pos < size // 4:
+            self.read_size = max(size // 2, self.min_read_size)
+        log.log("READ %s, %s bytes" % (self.fd, pos), "io")
+        return view[:pos]
+
     def handle_event(self, event):
         if self.buffer is None:
-            self.buffer = os.read(self.fd, 1024)
-            if not self.buffer:
+            data = self.read_chunk()
+            if data is None:
+                return
+            if not data:
                 self.eof = True
                 self.destroy()
+            elif self.zerocopy:
+                self.buffer = data
+            else:
+                self.buffer = bytes(data)
         if self.future is not None:
             self.future.set_result(None)
             self.future = None
+        elif self.enabled:
+            # Nobody is waiting for the data, stop polling until
+            # someone asks for it.
+            self.disable()
 
     def __aiter__(self):
         return self
     
     async def __anext__(self):
-        if self.buffer is None:
+        while self.buffer is None:
             if self.eof:
                 if self.at_eof: await self.at_eof()
                 raise StopAsyncIteration
+            if not self.enabled:
+                self.enable()
             future = self.future = asyncio.get_event_loop().create_future()
             await future
         try:
@@ -184,35 +557,238 @@ class InputHandler(IOHandler):
             args.append("data")
         return args
 
-class LineInputHandler(InputHandler):
-    def __init__(self, fd, borrowed = False, usage = None, at_eof = None):
-        InputHandler.__init__(self, fd, borrowed, usage, at_eof)
-        self.buffer = b""
+class LineQueue(object):
+    """Reading side of a queue of lines, self.lines. Subclasses
+    implement wait_for_lines()."""
+    def take_lines(self, max_lines = None, max_bytes = None):
+        """Removes and returns a list of up to max_lines of the lines
+        read so far, totalling at most max_bytes (line lengths plus
+        newlines, counted in characters). At least one line is always
+        returned if there is one."""
+        lines = self.lines
+        if max_bytes is None:
+            if max_lines is None or max_lines >= len(lines):
+                self.lines = collections.deque()
+                return list(lines)
+            return [lines.popleft() for i in range(max_lines)]
+        res = [lines.popleft()]
+        size = len(res[0]) + 1
+        while lines and (max_lines is None or len(res) < max_lines):
+            size += len(lines[0]) + 1
+            if size > max_bytes:
+                break
+            res.append(lines.popleft())
+        return res
+
+    def batches(self, max_lines = 1024, max_bytes = None):
+        """Returns an async iterator over lists of lines. Each batch
+        contains whatever lines are available when it is requested,
+        limited by max_lines and max_bytes."""
+        return LineBatches(self, max_lines, max_bytes)
+
+    def __aiter__(self):
+        return self
+    
+    async def __anext__(self):
+        if not self.lines and not await self.wait_for_lines():
+            raise StopAsyncIteration
+        return self.lines.popleft()
+
+class LineInputHandler(LineQueue, InputHandler):
+    """Reads data from fd and makes it available as an async
+    iterator of decoded lines.
+
+    Each chunk read is scanned once: all complete lines in it are
+    split off in one go and queued, and only the trailing partial
+    line is kept in self.buffer until the next chunk arrives.
+
+    Lines are decoded using encoding and errors, as for
+    bytes.decode(). The encoding must be ASCII compatible.
+    """
+    encoding = "utf-8"
+    errors = "strict"
+
+    def __init__(self, fd, borrowed = False, usage = None, at_eof = None, nonblocking = None, encoding = None, errors = None):
+        if encoding is not None:
+            self.encoding = encoding
+        if errors is not None:
+            self.errors = errors
+        self.lines = collections.deque()
+        InputHandler.__init__(self, fd, borrowed, usage, at_eof, nonblocking=nonblocking)
+        self.buffer = bytearray()
+
+    def split_lines(self, data):
+        scanned = len(self.buffer)
+        self.buffer += data
+        end = self.buffer.rfind(b"\n", scanned)
+        if end == -1:
+            return
+        self.lines.extend(self.buffer[:end].decode(self.encoding, self.errors).split("\n"))
+        del self.buffer[:end + 1]
 
     def handle_event(self, event):
-        if b'\n' not in self.buffer:
-            read_data = os.read(self.fd, 1024)
-            self.buffer += read_data
-            if not read_data:
+        if not self.lines:
+            data = self.read_chunk()
+            if data is None:
+                return
+            if data:
+                self.split_lines(data)
+            else:
                 self.eof = True
+                if self.buffer:
+                    # No newline at end of file...
+                    self.lines.append(self.buffer.decode(self.encoding, self.errors))
+                    self.buffer = bytearray()
                 self.destroy()
-            if self.future is not None:
+        if self.future is not None:
+            if self.lines or self.eof:
                 self.future.set_result(None)
                 self.future = None
+        elif self.enabled:
+            self.disable()
 
+    async def wait_for_lines(self):
+        """Waits until there is at least one line available, or EOF
+        is reached. Returns False at EOF."""
+        while not self.lines:
+            if self.eof:
+                if self.at_eof: await self.at_eof()
+                return False
+            if not self.enabled:
+                self.enable()
+            future = self.future = asyncio.get_event_loop().create_future()
+            await future
+        return True
+
+    def _repr_args(self):
+        args = InputHandler._repr_args(self)
+        if self.lines:
+            args.append("%s lines" % len(self.lines))
+        return args
+
+class LineBatches(object):
+    def __init__(self, handler, max_lines = None, max_bytes = None):
+        self.handler = handler
+        self.max_lines = max_lines
+        self.max_bytes = max_bytes
     def __aiter__(self):
         return self
-    
     async def __anext__(self):
-        while not self.eof and b'\n' not in self.buffer:
-            future = self.future = asyncio.get_event_loop().create_future()
+        if not self.handler.lines and not await self.handler.wait_for_lines():
+            raise StopAsyncIteration
+        return self.handler.take_lines(self.max_lines, self.max_bytes)
+
+class Channel(LineQueue):
+    """A bounded queue of lines connecting two python stages in the
+    same process, used instead of a pipe. Once capacity lines are
+    queued, put() waits for the reader to catch up. Writing to a
+    channel whose reader has gone away raises BrokenPipeError, like
+    writing to a pipe would."""
+    capacity = 1024
+
+    def __init__(self, capacity = None):
+        if capacity is not None:
+            self.capacity = capacity
+        self.lines = collections.deque()
+        self.eof = False
+        self.reader_closed = False
+        self.getter = None
+        self.putter = None
+
+    async def put(self, lines):
+        while len(self.lines) >= self.capacity and not self.reader_closed:
+            future = self.putter = asyncio.get_event_loop().create_future()
+            await future
+        if self.reader_closed:
+            raise BrokenPipeError("Channel reader closed")
+        self.lines.extend(lines)
+        if self.getter is not None:
+            self.getter.set_result(None)
+            self.getter = None
+
+    def wake_putter(self):
+        if self.putter is not None and len(self.lines) < self.capacity:
+            self.putter.set_result(None)
+            self.putter = None
+
+    def close(self):
+        """Called by the writer when there are no more lines."""
+        self.eof = True
+        if self.getter is not None:
+            self.getter.set_result(None)
+            self.getter = None
+
+    def close_reader(self):
+        """Called when the reader will not read any more lines."""
+        self.reader_closed = True
+        self.lines.clear()
+        if self.putter is not None:
+            self.putter.set_result(None)
+            self.putter = None
+
+    async def wait_for_lines(self):
+        while not self.lines:
+            if self.eof:
+                return False
+            future = self.getter = asyncio.get_event_loop().create_future()
             await future
-        if not self.buffer:
-            assert self.eof
-            if self.at_eof: await self.at_eof()
+        return True
+
+    def take_lines(self, max_lines = None, max_bytes = None):
+        try:
+            return LineQueue.take_lines(self, max_lines, max_bytes)
+        finally:
+            self.wake_putter()
+
+    async def __anext__(self):
+        if not self.lines and not await self.wait_for_lines():
             raise StopAsyncIteration
-        if b'\n' not in self.buffer:
-            self.buffer += b'\n' # No newline at end of file...
-        ret, self.buffer = self.buffer.split(b"\n", 1)
-        return ret.decode("utf-8")
+        try:
+            return self.lines.popleft()
+        finally:
+            self.wake_putter()
+
+    def __repr__(self):
+        args = ["%s/%s lines" % (len(self.lines), self.capacity)]
+        if self.eof:
+            args.append("EOF")
+        if self.reader_closed:
+            args.append("reader closed")
+        return "%s.%s(%s)" % (type(self).__module__, type(self).__name__, ",".join(args))
 
+class ChannelOutputHandler(WaitableHandler):
+    """Writes the items of an iterator or async iterator to a
+    Channel. to_lines converts each item to a list of lines (or
+    None), the same lines a LineInputHandler would have read had the
+    item been written to a pipe instead."""
+    def __init__(self, channel, iter, to_lines, usage = None):
+        self.channel = channel
+        self.iter = iter
+        self.to_lines = to_lines
+        WaitableHandler.__init__(self, None, borrowed=True, usage=usage, enabled=False)
+        self.pump_task = asyncio.get_event_loop().create_task(self.pump())
+
+    get_iter = OutputHandler.get_iter
+
+    async def pump(self):
+        iter = self.get_iter()
+        try:
+            while True:
+                try:
+                    val = await iter.__anext__()
+                except StopAsyncIteration:
+                    break
+                lines = self.to_lines(val)
+                if lines:
+                    await self.channel.put(lines)
+        except Exception as e:
+            self.channel.close()
+            self.destroy(e)
+        else:
+            self.channel.close()
+            self.destroy()
+
+    def _repr_args(self):
+        args = WaitableHandler._repr_args(self)
+        args[0] = repr(self.channel)
+        return args
@@ -81,6 +81,10 @@ class Pipeline(DescribableObject):
     """Abstract base class for all pipelines"""
     
     _print_state = threading.local()
+    # Set to a (encoding, errors) tuple by pipelines whose standard
+    # in/out can be connected to a neighbour using an iterio.Channel
+    _channel_stdin = None
+    _channel_stdout = None
     def __init__(self, env = None):
         self._env = env if env is not None else environ.env
         self._started = False
@@ -173,13 +177,30 @@ class Pipeline(DescribableObject):
 
     def __iter__(self):
         return asyncitertoiter(self.__aiter__())
+
+    def aiter_batches(self, max_lines=1024, max_bytes=None):
+        """Runs the pipeline and iterates over its standard output
+        lines in batches (lists of lines)."""
+        return self.run([redir.Redirect("stdout", redir.PIPE)]).aiter_batches(max_lines, max_bytes)
+
+    def iter_batches(self, max_lines=1024, max_bytes=None):
+        return asyncitertoiter(self.aiter_batches(max_lines, max_bytes))
     
     def __str__(self):
         # FIXME: Should use locale, but python's locale module is broken and ignores LC_* by default
         return bytes(self).decode("utf-8")
     def __bytes__(self):
         """Runs the pipeline and returns its standrad out output as a string"""
-        return b"".join(asyncitertoiter(self.run([redir.Redirect("stdout", redir.PIPE)]).iterbytes()))
+        res = bytearray()
+        for chunk in asyncitertoiter(self.run([redir.Redirect("stdout", redir.PIPE)]).iterbytes(zerocopy=True)):
+            res += chunk
+        return bytes(res)
+    def copy_to(self, dst, append=False):
+        """Runs the pipeline and copies its standard out to dst (an
+        fd, a binary file object or a path) inside the kernel. Returns
+        the number of bytes copied."""
+        pipeline = self.run([redir.Redirect("stdout", redir.PIPE)])
+        return asyncio.get_event_loop().run_until_complete(pipeline.copy_to(dst, append))
     def to_dataframe(self, col_slugify=True):
         import pandas as pd
         res = pd.read_fwf(io.StringIO(str(self)))
@@ -6,10 +6,12 @@ import asyncio
 import sys
 import base64
 import pickle
+import collections
 
 from . import command
 from . import builtin
 from . import running
+from . import function
 from .. import environ
 from .. import init
 
@@ -204,3 +206,90 @@ class Remote(builtin.Builtin):
         res = self._cmd._run(redirects, sess, indentation)
         self._redirects = self._cmd._redirects
         return res
+
+def _apply_chunk(func, lines):
+    return [func(line) for line in lines]
+
+class PMapBuiltin(builtin.Builtin):
+    """Applies a function to each line of standard in in parallel,
+    using a pool of worker processes, and outputs the results.
+
+        env.pmap(func, workers=4, ordered=True, chunksize=64)
+
+    Lines are sent to the workers in chunks of up to chunksize lines.
+    Unless ordered is False, the output is in the same order as the
+    input. workers defaults to the number of CPUs. The pool is shared
+    by all pmap:s with the same number of workers in the same
+    environment. func must be picklable, that is, not a lambda or a
+    nested function.
+    """
+    name = "pmap"
+
+    @property
+    def _func(self):
+        return [arg for arg in self._arg[1:] if not isinstance(arg, dict)][0]
+
+    @property
+    def _options(self):
+        options = {"workers": None, "ordered": True, "chunksize": 64}
+        for arg in self._arg[1:]:
+            if isinstance(arg, dict):
+                options.update(arg)
+        return options
+
+    def _repr(self):
+        return "pmap(%s)" % ", ".join(
+            [getattr(self._func, "__name__", repr(self._func))]
+            + ["%s=%s" % (key, value) for key, value in self._options.items()])
+
+    def _run(self, redirects, sess, indentation = ""):
+        self._cmd = function.Function(self._env, self._pmap)
+        res = self._cmd._run(redirects, sess, indentation)
+        self._redirects = self._cmd._redirects
+        return res
+
+    @staticmethod
+    async def _take(pending, ordered, wait = True):
+        """Removes and returns the results of finished chunks. If wait
+        is True, waits for at least one chunk to finish."""
+        if ordered:
+            res = []
+            while pending and (pending[0].done() or (wait and not res)):
+                res.append(await pending.popleft())
+            return res
+        if wait:
+            await asyncio.wait(pending, return_when=asyncio.FIRST_COMPLETED)
+        done = [future for future in pending if future.done()]
+        for future in done:
+            pending.remove(future)
+        return [future.result() for future in done]
+
+    @function.stage(batch=True)
+    async def _pmap(self, stdin):
+        func = self._func
+        options = self._options
+        pool = self._env._process_pool(options["workers"])
+        workers = pool._max_workers
+        chunksize = options["chunksize"]
+        ordered = options["ordered"]
+        loop = asyncio.get_event_loop()
+        pending = collections.deque()
+        buffer = []
+        try:
+            async for batch in stdin:
+                buffer.extend(batch)
+                # Keep the workers busy: send off full chunks, and
+                # whatever is left over if there are idle workers.
+                while len(buffer) >= chunksize or (buffer and len(pending) < workers):
+                    pending.append(loop.run_in_executor(pool, _apply_chunk, func, buffer[:chunksize]))
+                    del buffer[:chunksize]
+                for result in await self._take(pending, ordered, wait = len(pending) >= 2 * workers):
+                    yield result
+            if buffer:
+                pending.append(loop.run_in_executor(pool, _apply_chunk, func, buffer))
+            while pending:
+                for result in await self._take(pending, ordered):
+                    yield result
+        finally:
+            for future in pending:
+                future.cancel()
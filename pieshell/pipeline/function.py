@@ -13,9 +13,11 @@ import re
 import builtins        
 import functools
 import asyncio
+import io
+import inspect
 
 from ..utils import copy
-from ..utils.asyncutils import asyncmap, itertoasync
+from ..utils.asyncutils import asyncmap, itertoasync, threaditertoasync, asyncitertothread
 from .. import iterio
 from .. import redir
 from .. import log
@@ -24,13 +26,104 @@ from . import base
 from . import command
 import types
 
-    
+def stage(**options):
+    """Decorator setting options for a function used as a pipeline
+    stage:
+
+      batch - a number of lines (or True for 1024). The function gets
+        its standard in as lists of up to that many lines instead of
+        one line at a time, and may yield lists of lines as well as
+        single lines.
+      batch_bytes - an upper limit on the size of each batch.
+      flush - "latency" (the default) or "throughput", see
+        iterio.OutputHandler.
+      mode - "lines" (the default) or "bytes". In bytes mode, the
+        function gets its standard in as chunks of bytes, as they are
+        read, and whatever it yields is written as is, without any
+        newlines added.
+      encoding, errors - how lines are decoded and encoded, as for
+        bytes.decode(). Defaults to "utf-8" and "strict".
+      channel_capacity - the number of lines that can be queued
+        between this stage and an adjacent python stage, see
+        iterio.Channel.
+      executor - "thread" to run the function, and iterate over what
+        it returns, in the thread pool asyncutils.get_thread_pool(),
+        or an Executor to use instead of that pool. Its standard in
+        is then a synchronous iterator. Use this for functions that
+        block on I/O or spend a lot of time computing.
+      itemwise - the function is a generator that handles each item
+        of its input independently of the others. Chains of such
+        functions are fused and run over each batch of input, see
+        fuse_stages().
+    """
+    def decorator(fn):
+        fn.pieshell_options = dict(getattr(fn, "pieshell_options", {}), **options)
+        return fn
+    return decorator
+
+def convert_item(x, encoding = "utf-8", errors = "strict"):
+    if x is None:
+        return x
+    elif isinstance(x, bytes):
+        return x
+    elif isinstance(x, str):
+        return x.encode(encoding, errors)
+    else:
+        return str(x).encode(encoding, errors)
+
+def convert_batch(x, encoding = "utf-8", errors = "strict"):
+    if x is None:
+        return x
+    elif not isinstance(x, (list, tuple)):
+        x = convert_item(x, encoding, errors)
+        return x + b"\n" if x is not None else x
+    elif not x:
+        return None
+    try:
+        return ("\n".join(x) + "\n").encode(encoding, errors)
+    except TypeError:
+        return b"".join(item + b"\n"
+                        for item in (convert_item(item, encoding, errors) for item in x)
+                        if item is not None)
+
+def convert_bytes(x, encoding = "utf-8", errors = "strict"):
+    if x is None:
+        return x
+    elif isinstance(x, (bytes, bytearray, memoryview)):
+        return x if len(x) else None
+    return convert_item(x, encoding, errors) or None
+
+def item_lines(x, encoding = "utf-8", errors = "strict"):
+    """Returns the lines x would be read back as, had it been written
+    to a pipe by LineOutputHandler."""
+    if isinstance(x, str) and "\n" not in x:
+        return [x]
+    x = convert_item(x, encoding, errors)
+    if x is None:
+        return None
+    return x.decode(encoding, errors).split("\n")
+
+def batch_lines(x, encoding = "utf-8", errors = "strict"):
+    """Like item_lines, but for the output of batch mode stages."""
+    if not isinstance(x, (list, tuple)):
+        return item_lines(x, encoding, errors)
+    res = []
+    for item in x:
+        if isinstance(item, str) and "\n" not in item:
+            res.append(item)
+        else:
+            res.extend(item_lines(item, encoding, errors) or [])
+    return res
+
 class Function(base.Pipeline):
     """Encapsulates a function or iterator so that it can be used
     inside a pipeline. An iterator can only have its output piped into
     something. A function can have its output piped into something by
     yeilding values, and can take input in the form of an iterator as
-    a sole argument."""
+    a sole argument.
+
+    Options set on the function using the stage() decorator control
+    how input and output is passed to and from it."""
 
     def __init__(self, env, function, *arg, **kw):
         base.Pipeline.__init__(self, env)
@@ -39,6 +132,20 @@ class Function(base.Pipeline):
         self._kw = kw
     def __deepcopy__(self, memo = {}):
         return type(self)(self._env, self.__dict__["function"], *copy.deepcopy(self._arg), **copy.deepcopy(self._kw))
+    @property
+    def _options(self):
+        return getattr(self.__dict__["function"], "pieshell_options", {})
+    @property
+    def _channel_stdout(self):
+        options = self._options
+        if options.get("mode", "lines") != "lines":
+            return None
+        return (options.get("encoding", "utf-8"), options.get("errors", "strict"))
+    @property
+    def _channel_stdin(self):
+        if not isinstance(self.__dict__["function"], (types.FunctionType, types.MethodType)):
+            return None
+        return self._channel_stdout
     def _function_name(self):
         thing = self.__dict__["function"] # Don't wrap functions as instance methods
         if isinstance(thing, (types.FunctionType, types.MethodType)):
@@ -72,22 +179,70 @@ class Function(base.Pipeline):
         redirects = redirects.make_pipes()
         log.log(indentation + "Running %s with %s" % (repr(self), repr(redirects)), "cmd")
 
-        @asyncmap
-        def convert(x):
-            if x is None:
-                return x
-            elif isinstance(x, bytes):
-                return x
-            elif isinstance(x, str):
-                return x.encode("utf-8")
-            else:
-                return str(x).encode("utf-8")
+        options = self._options
+        batch = options.get("batch")
+        if batch is True:
+            batch = 1024
+        mode = options.get("mode", "lines")
+        if mode not in ("lines", "bytes"):
+            raise ValueError("Unknown stage mode %s" % (mode,))
+        encoding = options.get("encoding", "utf-8")
+        errors = options.get("errors", "strict")
+        executor = options.get("executor")
+        if executor == "thread":
+            executor = None
+        elif executor is not None and not hasattr(executor, "submit"):
+            raise ValueError("Unknown stage executor %s" % (executor,))
+        threaded = "executor" in options
 
         thing = self.__dict__["function"] # Don't wrap functions as instance methods
         if isinstance(thing, (types.FunctionType, types.MethodType)):
-            thing = thing(
-                iterio.LineInputHandler(redirects.stdin.open(False), usage=self),
-                *self._arg, **self._kw)
+            nonblocking = False if redirects.stdin.borrowed else None
+            if isinstance(redirects.stdin.source, iterio.Channel):
+                stdin = redirects.stdin.source
+                if batch:
+                    stdin = stdin.batches(batch, options.get("batch_bytes"))
+            elif mode == "bytes":
+                stdin = iterio.InputHandler(
+                    redirects.stdin.open(False), usage=self, nonblocking=nonblocking)
+            else:
+                stdin = iterio.LineInputHandler(
+                    redirects.stdin.open(False), usage=self, nonblocking=nonblocking,
+                    encoding=encoding, errors=errors)
+                if batch:
+                    stdin = stdin.batches(batch, options.get("batch_bytes"))
+            if threaded:
+                if mode == "bytes" or batch:
+                    stdin = asyncitertothread(stdin, asyncio.get_event_loop())
+                else:
+                    stdin = asyncitertothread(stdin.batches(), asyncio.get_event_loop(), flatten=True)
+            thing = thing(stdin, *self._arg, **self._kw)
+
+        if threaded and hasattr(thing, "__iter__") and not isinstance(thing, io.IOBase):
+            thing = threaditertoasync(thing, executor)
+
+        if isinstance(redirects.stdout.source, iterio.Channel):
+            if isinstance(thing, io.IOBase):
+                thing = (line[:-1] if line[-1:] in (b"\n", "\n") else line
+                         for line in thing)
+            return self._start(
+                redirects,
+                iterio.ChannelOutputHandler(
+                    redirects.stdout.source,
+                    thing,
+                    functools.partial(batch_lines if batch else item_lines,
+                                      encoding=encoding, errors=errors),
+                    usage=self))
+
+        if isinstance(thing, io.IOBase) and not isinstance(thing, io.TextIOBase):
+            # Binary files are copied to stdout without passing
+            # through python
+            output_handler = iterio.CopyHandler(
+                redirects.stdout.open(False),
+                thing,
+                usage=self,
+                nonblocking=False if redirects.stdout.borrowed else None)
+            return self._start(redirects, output_handler)
 
         if not hasattr(thing, "__iter__") and not hasattr(thing, "__aiter__"):
             if isinstance(thing, types.CoroutineType):
@@ -100,17 +255,128 @@ class Function(base.Pipeline):
                 thing = [thing]
         if hasattr(thing, "__iter__"):
             thing = itertoasync(thing)
-        thing = convert(thing)
-            
-        self._running_process = running.RunningFunction(
-            self,
-            iterio.LineOutputHandler(
+        if mode == "bytes":
+            output_handler = iterio.OutputHandler
+            convert = convert_bytes
+        elif batch:
+            output_handler = iterio.OutputHandler
+            convert = convert_batch
+        else:
+            output_handler = iterio.LineOutputHandler
+            convert = convert_item
+        thing = asyncmap(functools.partial(convert, encoding=encoding, errors=errors))(thing)
+
+        return self._start(
+            redirects,
+            output_handler(
                 redirects.stdout.open(False),
                 thing,
-                usage=self))
-        self._running_processes = [self._running_process]
-        self._redirects = self._running_process.redirects = redirects
+                usage=self,
+                mode=options.get("flush"),
+                nonblocking=False if redirects.stdout.borrowed else None))
+
+    def _start(self, redirects, output_handler):
+        if isinstance(redirects.stdin.source, iterio.Channel):
+            channel = redirects.stdin.source
+            output_handler.done_future.add_done_callback(lambda future: channel.close_reader())
+        self._running_processes = self._make_running_processes(redirects, output_handler)
+        self._redirects = redirects
 
         redirects.close_source_fds()
 
         return self._running_processes
+
+    def _make_running_processes(self, redirects, output_handler):
+        self._running_process = running.RunningFunction(self, output_handler)
+        self._running_process.redirects = redirects
+        return [self._running_process]
+
+
+class FusedFunction(Function):
+    """Runs a chain of synchronous python stages (Function instances)
+    as a single generator pipeline. Each of the stages still gets a
+    RunningFunction of its own, so that the chain can be inspected in
+    RunningPipeline.processes."""
+
+    def __init__(self, env, stages):
+        self.stages = stages
+        self.options = dict(stages[-1]._options)
+        head = stages[0].__dict__["function"]
+        if isinstance(head, (types.FunctionType, types.MethodType)):
+            # All stages are itemwise, apply them to each batch of
+            # input in turn
+            fns = [(stage.__dict__["function"], stage._arg, stage._kw) for stage in stages]
+            async def fused(stdin):
+                async for batch in stdin:
+                    items = batch
+                    for fn, arg, kw in fns:
+                        items = fn(items, *arg, **kw)
+                    yield list(items)
+            self.options["batch"] = stages[0]._options.get("batch") or True
+            thing = fused
+        else:
+            thing = iter(head)
+            for stage in stages[1:]:
+                thing = stage.__dict__["function"](thing, *stage._arg, **stage._kw)
+        Function.__init__(self, env, thing)
+
+    @property
+    def _options(self):
+        return self.options
+    def _function_name(self):
+        return " | ".join(stage._function_name() for stage in self.stages)
+    def _repr(self):
+        return " | ".join(repr(stage) for stage in self.stages)
+
+    def _make_running_processes(self, redirects, output_handler):
+        res = []
+        for stage in self.stages:
+            stage._running_processes = stage._make_running_processes(redirects, output_handler)
+            stage._redirects = redirects
+            res.extend(stage._running_processes)
+        return res
+
+def _fusion_kind(stage):
+    if not isinstance(stage, Function) or isinstance(stage, FusedFunction):
+        return None
+    options = stage._options
+    if options.get("mode", "lines") != "lines" or options.get("batch") or options.get("executor"):
+        return None
+    thing = stage.__dict__["function"]
+    if isinstance(thing, (types.FunctionType, types.MethodType)):
+        if not inspect.isgeneratorfunction(thing):
+            return None
+        return "itemwise" if options.get("itemwise") else "generator"
+    elif hasattr(thing, "__iter__") and not isinstance(thing, (io.IOBase, str, bytes)):
+        return "source"
+    return None
+
+def fuse_stages(stages):
+    """Given a list of pipelines to be piped together, replaces each
+    run of at least two synchronous python stages that can be run as
+    a single generator pipeline with a FusedFunction. Such a run
+    either starts with an iterable, followed by generator functions,
+    or consists of itemwise generator functions only (see stage()).
+    Returns None if there is nothing to fuse."""
+    res = []
+    fused = False
+    idx = 0
+    while idx < len(stages):
+        kind = _fusion_kind(stages[idx])
+        end = idx + 1
+        if kind in ("source", "itemwise"):
+            while end < len(stages):
+                next_kind = _fusion_kind(stages[end])
+                if (next_kind not in (("itemwise",) if kind == "itemwise" else ("itemwise", "generator"))
+                    or stages[end]._channel_stdin != stages[idx]._channel_stdout):
+                    break
+                end += 1
+        if end - idx > 1:
+            res.append(FusedFunction(stages[idx]._env, stages[idx:end]))
+            fused = True
+        else:
+            res.append(stages[idx])
+        idx = end
+    if not fused:
+        return None
+    return res
@@ -34,15 +34,58 @@ class Pipe(base.Pipeline):
         return type(self)(self._env, copy.deepcopy(self.src), copy.deepcopy(self.dst))
     def _repr(self):
         return u"%s | %s" % (repr(self.src), repr(self.dst))
+    @property
+    def _channel_stdin(self):
+        return self.src._channel_stdin
+    @property
+    def _channel_stdout(self):
+        return self.dst._channel_stdout
+    def _last_stage(self, pipeline, attr):
+        while isinstance(pipeline, Pipe):
+            pipeline = getattr(pipeline, attr)
+        return pipeline
+    def _make_channel(self):
+        """Returns an iterio.Channel to connect src and dst with if
+        they are both python stages, or None if they need a pipe."""
+        if self.src._channel_stdout is None or self.src._channel_stdout != self.dst._channel_stdin:
+            return None
+        capacity = None
+        for stage in (self._last_stage(self.dst, "src"), self._last_stage(self.src, "dst")):
+            if capacity is None and isinstance(stage, function.Function):
+                capacity = stage._options.get("channel_capacity")
+        return iterio.Channel(capacity)
+    def _stages(self):
+        """Returns the pipelines piped together by this, possibly
+        nested, Pipe, in order."""
+        res = []
+        for part in (self.src, self.dst):
+            if isinstance(part, Pipe):
+                res.extend(part._stages())
+            else:
+                res.append(part)
+        return res
     def _run(self, redirects, sess, indentation = ""):
         base.Pipeline._run(self, redirects, sess, indentation)
 
+        stages = function.fuse_stages(self._stages())
+        if stages is not None:
+            pipeline = functools.reduce(lambda src, dst: Pipe(self._env, src, dst), stages)
+            log.log(indentation + "Fused %s into %s" % (repr(self), repr(pipeline)), "cmd")
+            processes = pipeline._run(redirects, sess, indentation)
+            self._redirects = pipeline._redirects
+            return processes
+
         child_redirects = redir.Redirects(redirects)
         child_redirects.borrow()
 
         log.log(indentation + "Running %s with %s" % (repr(self), repr(redirects)), "cmd")
-        src = self.src._run(redir.Redirects(child_redirects).redirect("stdout", redir.PIPE), sess, indentation + "  ")
-        dst = self.dst._run(redir.Redirects(child_redirects).redirect("stdin", self.src._redirects.stdout.pipe), sess, indentation + "  ")
+        channel = self._make_channel()
+        if channel is not None:
+            src = self.src._run(redir.Redirects(child_redirects).redirect("stdout", channel), sess, indentation + "  ")
+            dst = self.dst._run(redir.Redirects(child_redirects).redirect("stdin", channel), sess, indentation + "  ")
+        else:
+            src = self.src._run(redir.Redirects(child_redirects).redirect("stdout", redir.PIPE), sess, indentation + "  ")
+            dst = self.dst._run(redir.Redirects(child_redirects).redirect("stdin", self.src._redirects.stdout.pipe), sess, indentation + "  ")
 
         self._redirects = self.src._redirects.merge(self.dst._redirects)
         self._redirects.register(redir.Redirect(self.src._redirects.stdin))
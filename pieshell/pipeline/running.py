@@ -13,8 +13,10 @@ import re
 import builtins        
 import functools
 import asyncio
+import pathlib
 
 from .. import iterio
+from ..utils.asyncutils import asyncitertoiter
 from .. import signalio
 from .. import redir
 from .. import tree
@@ -74,8 +76,33 @@ class RunningPipeline(object):
         self.handle_finish()
     def __aiter__(self):
         return iterio.LineInputHandler(self.pipeline._redirects.stdout.pipe, usage=self, at_eof=self.wait).__aiter__()
-    def iterbytes(self):
-        return iterio.InputHandler(self.pipeline._redirects.stdout.pipe, usage=self, at_eof=self.wait)
+    def aiter_batches(self, max_lines=1024, max_bytes=None):
+        """Iterates over the standard out lines of the pipeline in
+        batches (lists of lines) instead of one line at a time."""
+        return iterio.LineInputHandler(self.pipeline._redirects.stdout.pipe, usage=self, at_eof=self.wait).batches(max_lines, max_bytes)
+    def iter_batches(self, max_lines=1024, max_bytes=None):
+        return asyncitertoiter(self.aiter_batches(max_lines, max_bytes))
+    def iterbytes(self, zerocopy=False):
+        """Iterates over the standard out of the pipeline in chunks
+        of bytes. If zerocopy is True, the chunks are memoryviews that
+        are only valid until the next chunk is requested."""
+        return iterio.InputHandler(self.pipeline._redirects.stdout.pipe, usage=self, at_eof=self.wait, zerocopy=zerocopy)
+    async def copy_to(self, dst, append=False):
+        """Copies the standard out of the pipeline to dst (an fd, a
+        binary file object or a path) without passing it through
+        python, and waits for the pipeline to finish. Returns the
+        number of bytes copied."""
+        borrowed = True
+        if isinstance(dst, (str, bytes, pathlib.PurePath)):
+            dst = os.open(dst, os.O_WRONLY | os.O_CREAT | (os.O_APPEND if append else os.O_TRUNC), 0o777)
+            borrowed = False
+        elif hasattr(dst, "fileno"):
+            dst.flush()
+            dst = dst.fileno()
+        handler = iterio.CopyHandler(dst, self.pipeline._redirects.stdout.pipe, borrowed=borrowed, usage=self)
+        await handler.wait()
+        await self.wait()
+        return handler.copied
     def restart(self):
         self.pipeline_suspended = False
         for process in self.processes:
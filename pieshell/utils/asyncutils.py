@@ -1,5 +1,20 @@
 import asyncio
 import types
+import collections
+import concurrent.futures
+import time
+
+# The thread pool used by stages run with executor="thread". It is
+# created with thread_pool_size workers on first use, unless set
+# before that.
+thread_pool = None
+thread_pool_size = None
+
+def get_thread_pool():
+    global thread_pool
+    if thread_pool is None:
+        thread_pool = concurrent.futures.ThreadPoolExecutor(thread_pool_size, thread_name_prefix="pieshell")
+    return thread_pool
 
 def asyncitertoiter(aitf):
     loop = asyncio.get_event_loop()
@@ -26,6 +41,86 @@ class itertoasync(object):
             value = await value
         return value
 
+class threaditertoasync(object):
+    """Like itertoasync, but calls next() on the iterator in a thread
+    pool, so that an iterator that blocks does not block the event
+    loop. Items are fetched in batches of up to batch_size items, or
+    as many as can be fetched in batch_time seconds, and the next
+    batch is fetched while the current one is being consumed."""
+    batch_size = 1024
+    batch_time = 0.05
+
+    def __init__(self, it, executor = None):
+        self.it = iter(it)
+        self.executor = executor
+        self.buffer = collections.deque()
+        self.future = None
+        self.done = False
+        self.error = None
+    def __aiter__(self):
+        self.it = iter(self.it)
+        return self
+    def fetch(self):
+        res = []
+        deadline = time.monotonic() + self.batch_time
+        try:
+            while len(res) < self.batch_size and time.monotonic() < deadline:
+                res.append(next(self.it))
+        except StopIteration:
+            self.done = True
+        except Exception as e:
+            self.error = e
+            self.done = True
+        return res
+    def start_fetch(self):
+        self.future = asyncio.get_event_loop().run_in_executor(
+            self.executor or get_thread_pool(), self.fetch)
+    async def __anext__(self):
+        while not self.buffer:
+            if self.future is None:
+                if self.done:
+                    if self.error is not None:
+                        raise self.error
+                    raise StopAsyncIteration
+                self.start_fetch()
+            self.buffer.extend(await self.future)
+            self.future = None
+            if not self.done:
+                self.start_fetch()
+        value = self.buffer.popleft()
+        if isinstance(value, types.CoroutineType):
+            value = await value
+        return value
+
+class asyncitertothread(object):
+    """A synchronous iterator over the async iterator ait, for use in
+    a thread other than the one running loop. If flatten is True, ait
+    is expected to yield lists, the items of which are returned one
+    at a time."""
+    def __init__(self, ait, loop, flatten = False):
+        self.ait = ait.__aiter__()
+        self.loop = loop
+        self.flatten = flatten
+        self.buffer = collections.deque()
+        self.done = False
+    def __iter__(self):
+        return self
+    async def anext(self):
+        return await self.ait.__anext__()
+    def __next__(self):
+        while not self.buffer:
+            if self.done:
+                raise StopIteration
+            try:
+                item = asyncio.run_coroutine_threadsafe(self.anext(), self.loop).result()
+            except StopAsyncIteration:
+                self.done = True
+                raise StopIteration
+            if not self.flatten:
+                return item
+            self.buffer.extend(item)
+        return self.buffer.popleft()
+
 class asyncmap(object):
     def __init__(self, fn, aiter = None):
         self.fn = fn
@@ -1,6 +1,8 @@
 import json
+from ..pipeline.function import stage
 
 def map(func):
+    @stage(itemwise=True)
     def apply_map(iter):
         for item in iter:
             if item is None:
@@ -11,13 +13,14 @@ def map(func):
     return apply_map
 
 def filter(func):
+    @stage(itemwise=True)
     def apply_filter(iter):
         for item in iter:
             if item is None:
                 yield None
             elif func(item):
                 yield item
-    apply_map.__name__ = "filter(%s)" % (func.__name__,)
+    apply_filter.__name__ = "filter(%s)" % (func.__name__,)
     return apply_filter
 
 from_json = map(json.loads)
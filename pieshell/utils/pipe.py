@@ -1,6 +1,7 @@
 import os
 import fcntl
 import select
+import stat
 
 def _set_cloexec_flag(fd, cloexec=True):
     try:
@@ -24,3 +25,35 @@ def pipe_cloexec():
     _set_cloexec_flag(r)
     _set_cloexec_flag(w)
     return r, w
+
+def is_fifo(fd):
+    """Returns True if fd is a pipe or a named pipe."""
+    try:
+        return stat.S_ISFIFO(os.fstat(fd).st_mode)
+    except OSError:
+        return False
+
+def is_regular(fd):
+    """Returns True if fd is a regular file."""
+    try:
+        return stat.S_ISREG(os.fstat(fd).st_mode)
+    except OSError:
+        return False
+
+def set_nonblocking(fd, nonblocking=True):
+    """Sets or clears O_NONBLOCK on fd. Note that the flag belongs to
+    the open file description, so it is shared with all dups of fd."""
+    old = fcntl.fcntl(fd, fcntl.F_GETFL)
+    if nonblocking:
+        fcntl.fcntl(fd, fcntl.F_SETFL, old | os.O_NONBLOCK)
+    else:
+        fcntl.fcntl(fd, fcntl.F_SETFL, old & ~os.O_NONBLOCK)
+
+def is_pollable(fd):
+    """Returns True if fd can be waited on with poll/epoll. Regular
+    files can not, but are always readable and writable."""
+    try:
+        mode = os.fstat(fd).st_mode
+    except OSError:
+        return False
+    return stat.S_ISFIFO(mode) or stat.S_ISSOCK(mode) or stat.S_ISCHR(mode)
@@ -0,0 +1 @@
+version = '0.2.13'
@@ -45,6 +45,7 @@ setup(
             "bashsource = pieshell.pipeline.builtins:BashSource",
             "subshell = pieshell.pipeline.builtins:SubShell",
             "remote = pieshell.pipeline.builtins:Remote",
+            "pmap = pieshell.pipeline.builtins:PMapBuiltin",
         ]
     },
     scripts = ["pieshell/resources/get_completions"]
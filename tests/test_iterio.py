@@ -4,6 +4,7 @@ import pieshell.utils.asyncutils
 import sys
 import os
 import asyncio
+import tempfile
 
 
 class TestIterio(unittest.TestCase):
@@ -33,6 +34,60 @@ class TestIterio(unittest.TestCase):
         assert asyncio.get_event_loop().run_until_complete(ihi.__anext__()) == "hello 0"
         assert asyncio.get_event_loop().run_until_complete(ihi.__anext__()) == "hello 1"
 
+    def test_input_handler_bulk(self):
+        r, w = os.pipe()
+        os.write(w, b"x" * 60000)
+        os.close(w)
+        ih = pieshell.iterio.InputHandler(r, zerocopy=True)
+        async def tst():
+            res = bytearray()
+            chunks = 0
+            async for chunk in ih:
+                res += chunk
+                chunks += 1
+            return res, chunks
+        res, chunks = asyncio.get_event_loop().run_until_complete(tst())
+        assert res == b"x" * 60000
+        assert chunks <= 2
+
+    def test_bytes_large(self):
+        res = bytes(pieshell.env.head("-c", "3000000", "/dev/zero"))
+        assert len(res) == 3000000
+
+    def test_line_input_handler_many_lines(self):
+        r, w = os.pipe()
+        os.write(w, b"".join(b"line %d\n" % i for i in range(5000)) + b"last")
+        os.close(w)
+        ih = pieshell.iterio.LineInputHandler(r)
+        async def tst():
+            return [line async for line in ih]
+        res = asyncio.get_event_loop().run_until_complete(tst())
+        assert res == ["line %d" % i for i in range(5000)] + ["last"]
+
+    def test_output_handler_throughput(self):
+        r, w = os.pipe()
+        lines = [b"line %d" % i for i in range(20000)]
+        oh = pieshell.iterio.LineOutputHandler(w, iter(lines), mode="throughput")
+        ih = pieshell.iterio.LineInputHandler(r)
+        async def tst():
+            res = [line async for line in ih]
+            await oh.wait()
+            return res
+        res = asyncio.get_event_loop().run_until_complete(tst())
+        assert res == [line.decode("ascii") for line in lines]
+
+    def test_copy_handler(self):
+        r, w = os.pipe()
+        os.write(w, b"x" * 60000)
+        os.close(w)
+        with tempfile.TemporaryFile() as f:
+            ch = pieshell.iterio.CopyHandler(f.fileno(), r, borrowed=True)
+            asyncio.get_event_loop().run_until_complete(ch.wait())
+            assert ch.method == "splice"
+            assert ch.copied == 60000
+            f.seek(0)
+            assert f.read() == b"x" * 60000
+
     def test_run(self):
         ls = pieshell.env.echo("hello").run([pieshell.redir.Redirect("stdout", pieshell.redir.PIPE)])
         ih = ls.__aiter__()
@@ -2,6 +2,7 @@ import unittest
 import pieshell
 import sys
 import os
+import tempfile
 
 dir = os.path.dirname(__file__)
 sys.path[0:0] = [dir]
@@ -74,3 +75,101 @@ class TestPipelines(unittest.TestCase):
     def test_multi_pipe_input(self):
         e = pieshell.env
         list(e.cat(e.ls, e.ls))
+
+    def test_batches(self):
+        e = pieshell.env
+        batches = list(e.seq("1", "3000").iter_batches(max_lines=1000))
+        self.assertTrue(all(len(batch) <= 1000 for batch in batches))
+        self.assertEqual(sum(batches, []), [str(i) for i in range(1, 3001)])
+
+    def test_batched_function(self):
+        e = pieshell.env
+        @pieshell.stage(batch=100)
+        async def double(stdin):
+            async for batch in stdin:
+                assert len(batch) <= 100
+                yield [str(int(line) * 2) for line in batch]
+        self.assertEqual(list(e.seq("1", "1000") | double), [str(i * 2) for i in range(1, 1001)])
+
+    def test_copy_to(self):
+        e = pieshell.env
+        with tempfile.TemporaryDirectory() as d:
+            path = os.path.join(d, "out")
+            self.assertEqual(e.seq("1", "100000").copy_to(path), len(str(e.seq("1", "100000"))))
+            with open(path, "rb") as f:
+                self.assertEqual(str(open(path, "rb") | e.cat), f.read().decode("utf-8"))
+
+    def test_bytes_function(self):
+        e = pieshell.env
+        @pieshell.stage(mode="bytes")
+        async def upper(stdin):
+            async for chunk in stdin:
+                assert isinstance(chunk, bytes)
+                yield chunk.upper()
+        self.assertEqual(str(e.printf("a\\nb") | upper), "A\nB")
+
+    def test_function_encoding(self):
+        e = pieshell.env
+        @pieshell.stage(encoding="latin-1")
+        async def passthrough(stdin):
+            async for line in stdin:
+                yield line
+        self.assertEqual(bytes(e.printf("\\xe5\\xe4\\n") | passthrough), b"\xe5\xe4\n")
+
+    def test_function_channel(self):
+        e = pieshell.env
+        def gen():
+            for i in range(3000):
+                yield i
+            yield "a\nb"
+        @pieshell.stage(channel_capacity=100)
+        async def upper(stdin):
+            async for line in stdin:
+                yield line.upper()
+        @pieshell.stage(batch=10)
+        async def check(stdin):
+            async for batch in stdin:
+                yield batch
+        pipeline = pieshell.pipeline.function.Function(e, gen()) | upper | check
+        running = pipeline.run([pieshell.redir.Redirect("stdout", pieshell.redir.PIPE)])
+        self.assertIsInstance(running.processes[0].iohandler, pieshell.iterio.ChannelOutputHandler)
+        self.assertEqual(running.processes[0].iohandler.channel.capacity, 100)
+        self.assertEqual(list(pieshell.utils.asyncutils.asyncitertoiter(running.__aiter__())),
+                         [str(i) for i in range(3000)] + ["A", "B"])
+
+    def test_fused_functions(self):
+        e = pieshell.env
+        from pieshell.utils import jsonutils
+        def numbered(items):
+            for idx, item in enumerate(items):
+                yield "%s %s" % (idx, item)
+        pipeline = (e.echo('{"a": 1}\n{"a": 2}\n{"a": 3}')
+                    | jsonutils.from_json
+                    | jsonutils.filter(lambda x: x["a"] > 1)
+                    | jsonutils.to_json)
+        running = pipeline.run([pieshell.redir.Redirect("stdout", pieshell.redir.PIPE)])
+        self.assertEqual(len(running.processes), 4)
+        self.assertIs(running.processes[1].iohandler, running.processes[3].iohandler)
+        self.assertEqual(list(pieshell.utils.asyncutils.asyncitertoiter(running.__aiter__())), ['{"a": 2}', '{"a": 3}'])
+        self.assertEqual(list(pieshell.pipeline.function.Function(e, [{"a": 1}]) | jsonutils.to_json | numbered),
+                         ['0 {"a": 1}'])
+
+    def test_threaded_function(self):
+        e = pieshell.env
+        import threading
+        import time
+        main_thread = threading.get_ident()
+        @pieshell.stage(executor="thread")
+        def slow(stdin):
+            for line in stdin:
+                assert threading.get_ident() != main_thread
+                time.sleep(0.001)
+                yield int(line) * 2
+        self.assertEqual(list(e.seq("1", "100") | slow | e.cat), [str(i * 2) for i in range(1, 101)])
+
+    def test_pmap(self):
+        e = pieshell.env
+        self.assertEqual(list(e.seq("1", "2000") | e.pmap(int, workers=2, chunksize=100)),
+                         [str(i) for i in range(1, 2001)])
+        self.assertEqual(sorted(e.seq("1", "500") | e.pmap(str.upper, ordered=False), key=int),
+                         [str(i) for i in range(1, 501)])